@@ -73,6 +73,12 @@ class Interactor:
         if key is not None:
             varname = key.affix_to(varname)
 
+        if varname not in self.accumulators:
+            # Nothing listens to this variable, so the value goes through
+            if value is ABSENT:
+                raise PteraNameError(varname, self.fn)
+            return value
+
         with self.work_on(varname, key, category) as wfr:
 
             fr_value = wfr.intercept(value)
@@ -103,6 +109,8 @@ class Interactor:
 class WorkingFrame:
     """Context manager to facilitate working on a variable."""
 
+    __slots__ = ("varname", "key", "category", "accumulators")
+
     def __init__(self, varname, key, category, accumulators):
         self.varname = varname
         self.key = key
@@ -168,6 +176,8 @@ class Capture:
         values: The list of values taken by matching variables.
     """
 
+    __slots__ = ("element", "capture", "names", "values")
+
     def __init__(self, element):
         self.element = element
         self.capture = element.capture
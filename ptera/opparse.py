@@ -106,6 +106,9 @@ class Lexer:
         """
         self.definitions = definitions
         self.token_types = [None, *definitions.values()]
+        self.compiled = [
+            (re.compile(rx), typ) for rx, typ in definitions.items()
+        ]
 
     def __call__(self, code):
         """Lex the given code.
@@ -117,8 +120,8 @@ class Lexer:
         tokens = []
         current = 0
         while code:
-            for rx, typ in self.definitions.items():
-                m = re.match(rx, code)
+            for rx, typ in self.compiled:
+                m = rx.match(code)
                 if m:
                     tokens.append(
                         Token(
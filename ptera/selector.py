@@ -6,6 +6,7 @@ import re
 import sys
 import types
 from collections import defaultdict
+from functools import lru_cache
 from itertools import count
 
 from . import opparse
@@ -20,6 +21,10 @@ from .utils import (
 
 _valid_hashvars = ("#enter", "#error", "#exit", "#receive", "#value", "#yield")
 
+_FLOAT_RE = re.compile(r"-?[0-9]+\.[0-9]*")
+_INT_RE = re.compile(r"-?[0-9]+")
+_STRING_RE = re.compile(r"'[^']*'")
+
 
 class SelectorError(Exception):
     """Error raised for invalid selectors."""
@@ -38,14 +43,29 @@ def check_element(el, name, category):
 class InternedMC(type):
     def __new__(cls, name, bases, dct):
         dct["_cache"] = {}
+        if "__init__" in dct:
+            # The keyword-only arguments of __init__, in a fixed order
+            code = dct["__init__"].__code__
+            start = code.co_argcount
+            dct["_fields"] = code.co_varnames[
+                start : start + code.co_kwonlyargcount
+            ]
         return super().__new__(cls, name, bases, dct)
 
     def __call__(cls, **kwargs):
         kwargs = {**cls._constructor_defaults, **kwargs}
-        key = tuple(sorted(kwargs.items()))
-        if key not in cls._cache:
-            cls._cache[key] = super().__call__(**kwargs)
-        return cls._cache[key]
+        if len(kwargs) != len(cls._fields):
+            # Let __init__ complain about the unexpected arguments
+            return super().__call__(**kwargs)
+        try:
+            key = tuple([kwargs[field] for field in cls._fields])
+        except KeyError:
+            # Let __init__ complain about the missing arguments
+            return super().__call__(**kwargs)
+        rval = cls._cache.get(key)
+        if rval is None:
+            rval = cls._cache[key] = super().__call__(**kwargs)
+        return rval
 
 
 class Selector(metaclass=InternedMC):
@@ -631,11 +651,11 @@ class VSymbol(VNode):
     def eval(self, env):
         x = self.value
 
-        if re.fullmatch(r"-?[0-9]+\.[0-9]*", x):
+        if _FLOAT_RE.fullmatch(x):
             return float(x)
-        elif re.fullmatch(r"-?[0-9]+", x):
+        elif _INT_RE.fullmatch(x):
             return int(x)
-        elif re.fullmatch(r"'[^']*'", x):
+        elif _STRING_RE.fullmatch(x):
             return x[1:-1]
         elif isinstance(env, (dict, DictPile)):
             return dict_resolver(env)(x)
@@ -737,6 +757,7 @@ def vmake_symbol(node, context):
     return VSymbol(node.value)
 
 
+@lru_cache(maxsize=1024)
 def parse(x):
     return evaluate(parser(x))
 
@@ -766,6 +787,13 @@ def _dig(fn):
     return fn
 
 
+def _first_argname(fn):
+    if isinstance(fn, types.FunctionType) and fn.__code__.co_argcount:
+        # Positional arguments come first in co_varnames
+        return fn.__code__.co_varnames[0]
+    return inspect.getfullargspec(fn).args[0]
+
+
 def _resolve(selector, env, cnt):
     if isinstance(selector, Call):
         el = _resolve(selector.element, env, cnt)
@@ -775,7 +803,7 @@ def _resolve(selector, env, cnt):
             # If fn is a method, we add a capture for "self" that must
             # match the instance.
             real_fn = _dig(fn.__func__)
-            selfname = inspect.getfullargspec(real_fn).args[0]
+            selfname = _first_argname(real_fn)
             el = el.clone(name=real_fn)
             captures.append(
                 Element(
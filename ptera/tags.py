@@ -8,10 +8,9 @@ to these tags.
 
 
 def _merge(a, b):
-    members = set()
-    members.update(a.members if isinstance(a, TagSet) else {a})
-    members.update(b.members if isinstance(b, TagSet) else {b})
-    return TagSet(members)
+    am = a.members if isinstance(a, TagSet) else frozenset((a,))
+    bm = b.members if isinstance(b, TagSet) else (b,)
+    return TagSet(am.union(bm))
 
 
 class Tag:
@@ -21,6 +20,8 @@ class Tag:
         name: The name of the tag.
     """
 
+    __slots__ = ("name",)
+
     def __init__(self, name):
         self.name = name
 
@@ -36,6 +37,8 @@ class Tag:
 class TagSet:
     """Set of multiple tags."""
 
+    __slots__ = ("members",)
+
     def __init__(self, members):
         self.members = frozenset(members)
 
@@ -45,6 +48,9 @@ class TagSet:
     def __eq__(self, other):
         return isinstance(other, TagSet) and other.members == self.members
 
+    def __hash__(self):
+        return hash(self.members)
+
     def __repr__(self):
         return " & ".join(sorted(map(str, self.members)))
 
@@ -72,7 +78,7 @@ def match_tag(to_match, tg):
     if tg is None:
         return False
     elif isinstance(tg, TagSet):
-        return any(cat == to_match for cat in tg.members)
+        return to_match in tg.members
     else:
         return tg == to_match
 
@@ -1,15 +1,16 @@
 """Code transform that instruments probed functions."""
 
 import ast
+import builtins
 import inspect
+import io
 import re
 import sys
+import threading
 import tokenize
 import types
 from ast import NodeTransformer, NodeVisitor
-from collections import Counter
-from copy import deepcopy
-from functools import reduce
+from collections import Counter, OrderedDict
 from itertools import count
 from textwrap import dedent
 from types import TracebackType
@@ -18,9 +19,76 @@ from .selector import Element, check_element
 from .tags import enter_tag, exit_tag, get_tags
 from .utils import ABSENT, DictPile
 
-_IDX = count()
+_next_idx = count().__next__
 _GENERIC = Element(name=None)
 
+# Expression contexts hold no data, so all synthesized nodes can share them,
+# like the nodes produced by ast.parse do
+_LOAD = ast.Load()
+_STORE = ast.Store()
+
+# Hashvars that are only set around the body of the function
+_ROOT_HASHVARS = ("#enter", "#error", "#exit")
+
+# Fields through which statements contain other statements
+_BLOCK_FIELDS = ("body", "handlers", "orelse", "finalbody", "cases")
+
+_TAG_SPLIT_RE = re.compile(r" *& *")
+_COMMENT_RE = re.compile(r"^[ \t]*#(.*)$", re.MULTILINE)
+
+# Cache the instrumented code and variable info of transformed functions,
+# keeping the most recently used entries
+_transform_cache = OrderedDict()
+_transform_cache_size = 1024
+_transform_cache_lock = threading.Lock()
+
+
+if sys.version_info >= (3, 9, 0):  # pragma: no cover
+    # Subscript.slice holds the index expression directly
+
+    def _index(value):
+        return value
+
+    def _slice_value(slc):
+        return slc
+
+else:  # pragma: no cover
+    # Subscript.slice holds an ast.Index wrapping the expression
+
+    def _index(value):
+        return ast.Index(value=value)
+
+    def _slice_value(slc):
+        return slc.value if isinstance(slc, ast.Index) else slc
+
+
+if sys.version_info >= (3, 8, 0):  # pragma: no cover
+
+    def _with_names(code, names):
+        return code.replace(co_names=names)
+
+else:  # pragma: no cover
+    # CodeType.replace does not exist yet
+
+    def _with_names(code, names):
+        return types.CodeType(
+            code.co_argcount,
+            code.co_kwonlyargcount,
+            code.co_nlocals,
+            code.co_stacksize,
+            code.co_flags,
+            code.co_code,
+            code.co_consts,
+            names,
+            code.co_varnames,
+            code.co_filename,
+            code.co_name,
+            code.co_firstlineno,
+            code.co_lnotab,
+            code.co_freevars,
+            code.co_cellvars,
+        )
+
 
 class Key:
     """Represents an attribute or index on a variable.
@@ -30,6 +98,8 @@ class Key:
         value: The value of the attribute or index.
     """
 
+    __slots__ = ("type", "value")
+
     def __init__(self, type, value):
         self.type = type
         self.value = value
@@ -83,10 +153,11 @@ class PteraNameError(NameError):
 
 def name_error(varname, function, pop_frames=1):
     """Raise a PteraNameError pointing to the right location."""
-    fr = inspect.currentframe()
-    for _ in range(pop_frames + 1):
-        if fr:
-            fr = fr.f_back
+    try:
+        fr = sys._getframe(pop_frames + 1)
+    except ValueError:  # pragma: no cover
+        # The call stack is not that deep
+        fr = None
     err = PteraNameError(varname, function)
     try:  # pragma: no cover
         tb = TracebackType(
@@ -100,31 +171,193 @@ def name_error(varname, function, pop_frames=1):
         return err
 
 
-def _readline_mock(src):
-    """Line reader for the given text.
+if sys.version_info >= (3, 8, 0):  # pragma: no cover
 
-    This is meant to be used with Python's tokenizer.
+    def _string_spans(src, tree, lineno):
+        return [
+            (node.lineno, node.end_lineno)
+            for node in ast.walk(tree)
+            if isinstance(node, (ast.Constant, ast.JoinedStr))
+            and node.end_lineno > node.lineno
+        ]
+
+else:  # pragma: no cover
+    # Nodes have no end_lineno, so the strings are found with the tokenizer
+
+    def _string_spans(src, tree, lineno):
+        return [
+            (tok.start[0] + lineno - 1, tok.end[0] + lineno - 1)
+            for tok in tokenize.generate_tokens(io.StringIO(src).readline)
+            if tok.type == tokenize.STRING and tok.end[0] > tok.start[0]
+        ]
+
+
+def _scrape_comments(src, tree, lineno=1):
+    """Map the line following each comment line to the comment's text.
+
+    Only comments that take up a whole line are considered, and consecutive
+    comment lines are merged. Lines that start with ``#`` inside a
+    multiline string are not comments and are skipped. The first line of
+    src is numbered lineno, which should match the line numbers in tree.
     """
-    curr = -1
-    src = bytes(src, encoding="utf8")
-    lines = [line + b"\n" for line in src.split(b"\n")]
+    if "#" not in src:
+        return {}
+
+    found = []
+    pos = 0
+    line = lineno
+    for m in _COMMENT_RE.finditer(src):
+        line += src.count("\n", pos, m.start())
+        pos = m.start()
+        found.append((line, m.group(1).strip()))
+
+    if found and ('"""' in src or "'''" in src or "\\\n" in src):
+        spans = _string_spans(src, tree, lineno)
+        found = [
+            (line, text)
+            for line, text in found
+            if not any(start < line <= end for start, end in spans)
+        ]
+
+    comments = {}
+    for line, text in found:
+        if line in comments:
+            comments[line + 1] = comments.pop(line) + "\n" + text
+        else:
+            comments[line + 1] = text
+    return comments
 
-    def readline():
-        nonlocal curr
-        curr = curr + 1
-        if curr >= len(lines):
-            raise StopIteration
-        return lines[curr]
 
-    return readline
+def _dotted_path(node):
+    """Return the list of names in a (dotted) name such as a.b.c, or None."""
+    path = []
+    while isinstance(node, ast.Attribute):
+        path.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    path.append(node.id)
+    path.reverse()
+    return path
+
+
+def _get_source(code):
+    """Return the dedented source, filename and first line of code."""
+    lines, lineno = inspect.getsourcelines(code)
+    return dedent("".join(lines)), inspect.getsourcefile(code), lineno
 
 
 def _gensym():
     """Generate a fresh symbol."""
-    return f"_ptera__{next(_IDX)}"
+    return f"_ptera__{_next_idx()}"
+
+
+_LOCATION_ATTRIBUTES = ("lineno", "col_offset", "end_lineno", "end_col_offset")
+
 
+def _locate(node, orig):
+    """Give the source location of orig to the synthesized nodes in node.
 
-class ExternalVariableCollector(NodeVisitor):
+    This replaces a final ``ast.fix_missing_locations`` over the whole
+    transformed tree: we only walk down through nodes that have no
+    location yet, so the original code they contain is not traversed.
+    Nodes returned by the transformer are always located, so a node that
+    has a location is known to be fully located.
+    """
+    location = [
+        (attr, getattr(orig, attr))
+        for attr in _LOCATION_ATTRIBUTES
+        if getattr(orig, attr, None) is not None
+    ]
+    todo = [node]
+    while todo:
+        current = todo.pop()
+        if "lineno" in current._attributes:
+            for attr, value in location:
+                if getattr(current, attr, None) is None:
+                    setattr(current, attr, value)
+        for field in current._fields:
+            child = getattr(current, field, None)
+            for x in child if isinstance(child, list) else (child,):
+                # Expression contexts and operators hold neither a location
+                # nor children, so there is nothing to do for them
+                if (
+                    isinstance(x, ast.AST)
+                    and (x._fields or x._attributes)
+                    and getattr(x, "lineno", None) is None
+                ):
+                    todo.append(x)
+    return node
+
+
+def _evaluate(node, glb, filename):
+    """Evaluate the annotation node in the globals glb."""
+    path = _dotted_path(node)
+    if isinstance(node, ast.Constant):
+        result = node.value
+    elif path is not None:
+        # Names and dotted names are the most common annotations, and
+        # looking them up directly is much cheaper than compiling them
+        base, *attrs = path
+        result = glb.get(base, ABSENT)
+        if result is ABSENT:
+            result = getattr(builtins, base, ABSENT)
+        try:
+            for attr in attrs:
+                if result is ABSENT:
+                    break
+                result = getattr(result, attr)
+        except Exception:
+            result = ABSENT
+    else:
+        try:
+            result = eval(
+                compile(ast.Expression(node), filename, "eval"), glb, glb
+            )
+        except Exception:  # pragma: no cover
+            result = ABSENT
+    return result
+
+
+def _same_evaluations(evaluated, glb, filename):
+    """Check that the annotations still evaluate to the same values.
+
+    Arguments:
+        evaluated: A list of ``(node, value)`` pairs, as recorded when the
+            function was transformed.
+        glb: The globals to evaluate the nodes in.
+        filename: The file the nodes come from.
+    """
+    for node, value in evaluated:
+        new_value = _evaluate(node, glb, filename)
+        if new_value is not value and (
+            type(new_value) is not type(value) or new_value != value
+        ):
+            return False
+    return True
+
+
+def _stored_names(tree):
+    """Return the names of the variables stored to anywhere in tree."""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            names.add(node.id)
+        elif isinstance(node, ast.ExceptHandler) and node.name is not None:
+            names.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                names.add((alias.asname or alias.name).split(".")[0])
+        elif (
+            isinstance(node, (ast.Attribute, ast.Subscript))
+            and isinstance(node.ctx, ast.Store)
+            and isinstance(node.value, ast.Name)
+        ):
+            names.add(node.value.id)
+    return names
+
+
+class ExternalVariableCollector:
     """Collect variables referred to but not defined in the given AST.
 
     The attributes are filled after the object is created.
@@ -138,6 +371,11 @@ class ExternalVariableCollector(NodeVisitor):
             if they are defined as variables in the body or as function
             arguments.
         funcnames: Set of function names defined in the body.
+        mutated: Set of variables that have an attribute or an index
+            assigned to.
+        stored: Set of variables that are stored to anywhere in the body,
+            including in except handlers, whether or not an argument of
+            the same name shadows them somewhere.
     """
 
     def __init__(self, tree, comments, closure_vars):
@@ -148,42 +386,73 @@ class ExternalVariableCollector(NodeVisitor):
         self.vardoc = {}
         self.provenance = {v: "closure" for v in closure_vars}
         self.funcnames = set()
-        self.visit(tree)
+        self.mutated = set()
+        self.stored = set()
+        self.collect(tree)
         self.used -= self.funcnames
 
-    def visit_FunctionDef(self, node):
-        self.funcnames.add(node.name)
-        self.generic_visit(node)
-
-    def visit_Name(self, node):
-        if isinstance(node.ctx, ast.Load):
-            self.used.add(node.id)
-        else:
-            if node.lineno in self.comments:
-                self.vardoc[node.id] = self.comments[node.lineno]
-            self.provenance[node.id] = "body"
-            self.assigned.add(node.id)
-
-    def visit_ExceptHandler(self, node):
-        if node.name is not None:
-            self.provenance[node.name] = "body"
-            self.assigned.add(node.name)
-
-    def visit_Import(self, node):
-        self.visit_ImportFrom(node)
-
-    def visit_ImportFrom(self, node):
-        for alias in node.names:
-            name = alias.asname or alias.name
-            name = name.split(".")[0]
-            self.provenance[name] = "body"
-            self.assigned.add(name)
-
-    def visit_arg(self, node):
-        if node.lineno in self.comments:
-            self.vardoc[node.arg] = self.comments[node.lineno]
-        self.provenance[node.arg] = "argument"
-        self.assigned.add(node.arg)
+    def collect(self, tree):
+        """Walk the tree in the same order as a NodeVisitor would."""
+        used = self.used
+        assigned = self.assigned
+        comments = self.comments
+        vardoc = self.vardoc
+        provenance = self.provenance
+        stored = self.stored
+
+        todo = [tree]
+        while todo:
+            node = todo.pop()
+
+            if isinstance(node, ast.Name):
+                if isinstance(node.ctx, ast.Load):
+                    used.add(node.id)
+                else:
+                    if node.lineno in comments:
+                        vardoc[node.id] = comments[node.lineno]
+                    provenance[node.id] = "body"
+                    assigned.add(node.id)
+                    stored.add(node.id)
+                continue
+
+            elif isinstance(node, ast.arg):
+                if node.lineno in comments:
+                    vardoc[node.arg] = comments[node.lineno]
+                provenance[node.arg] = "argument"
+                assigned.add(node.arg)
+                continue
+
+            elif isinstance(node, ast.ExceptHandler):
+                if node.name is not None:
+                    provenance[node.name] = "body"
+                    assigned.add(node.name)
+                # The handler's body is not collected, but the variables it
+                # stores to may still be instrumented
+                stored.update(_stored_names(node))
+                continue
+
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                for alias in node.names:
+                    name = alias.asname or alias.name
+                    name = name.split(".")[0]
+                    provenance[name] = "body"
+                    assigned.add(name)
+                    stored.add(name)
+                continue
+
+            elif isinstance(node, ast.FunctionDef):
+                self.funcnames.add(node.name)
+
+            elif isinstance(node, (ast.Attribute, ast.Subscript)):
+                if isinstance(node.ctx, ast.Store) and isinstance(
+                    node.value, ast.Name
+                ):
+                    self.mutated.add(node.value.id)
+
+            # Push the children in reverse so that they are popped in order
+            children = list(ast.iter_child_nodes(node))
+            children.reverse()
+            todo += children
 
 
 class SimpleVariableCollector(NodeVisitor):
@@ -208,33 +477,44 @@ class PteraTransformer(NodeTransformer):
         self.used = evc.used
         self.assigned = evc.assigned
         self.free = evc.free
-        self.external = evc.used - evc.assigned - evc.free
+        self.external = evc.used.difference(evc.assigned, evc.free)
         self.provenance = evc.provenance
+        self.mutated = evc.mutated
+        self.stored = evc.stored
         for ext in self.external:
             self.provenance[ext] = "external"
         self.annotated = {}
         self.evalcache = {None: ABSENT}
+        self.instrument_cache = {}
         self.linenos = {}
         self.defaults = {}
         self.lib = lib
         self.filename = filename
         self.globals = glb
         self.to_instrument = to_instrument
-        self.result = self.visit_FunctionDef(tree, root=True)
+        # Annotations only matter to elements that filter on a category
+        self.check_categories = any(
+            el.category is not None for el in to_instrument
+        )
+        self.result = self.visit_root(tree)
 
     def should_instrument(self, varname, ann=None):
-        evaluated_ann = self._evaluate(ann)
-        if any(
-            check_element(el, varname, evaluated_ann)
-            for el in self.to_instrument
-        ):
-            return True
-        return False
+        if not self.check_categories:
+            ann = None
+        key = (varname, ann)
+        rval = self.instrument_cache.get(key)
+        if rval is None:
+            evaluated_ann = self._evaluate(ann)
+            rval = self.instrument_cache[key] = any(
+                check_element(el, varname, evaluated_ann)
+                for el in self.to_instrument
+            )
+        return rval
 
     def _ann(self, ann):
         if isinstance(ann, ast.Str) and ann.s.startswith("@"):
-            tags = re.split(r" *& *", ann.s)
-            ann = ast.copy_location(
+            tags = _TAG_SPLIT_RE.split(ann.s)
+            ann = _locate(
                 ast.Call(
                     func=self._get("get_tags"),
                     args=[
@@ -246,34 +526,22 @@ class PteraTransformer(NodeTransformer):
                 ),
                 ann,
             )
-            ast.fix_missing_locations(ann)
 
         return ann
 
     def _evaluate(self, node):
         if node in self.evalcache:
             return self.evalcache[node]
-        ast.fix_missing_locations(node)
-        try:
-            result = eval(
-                compile(
-                    ast.Expression(node),
-                    self.filename,
-                    "eval",
-                ),
-                self.globals,
-                self.globals,
-            )
-        except Exception:  # pragma: no cover
-            result = ABSENT
-        self.evalcache[node] = result
+        result = self.evalcache[node] = _evaluate(
+            node, self.globals, self.filename
+        )
         return result
 
     def _get(self, name):
-        return ast.Name(id=self.lib[name][0], ctx=ast.Load())
+        return ast.Name(id=self.lib[name][0], ctx=_LOAD)
 
     def _set(self, name):
-        return ast.Name(id=self.lib[name][0], ctx=ast.Store())
+        return ast.Name(id=self.lib[name][0], ctx=_STORE)
 
     def _interact(self, *args):
         varname, key, ann, value, overridable = args
@@ -286,7 +554,7 @@ class PteraTransformer(NodeTransformer):
         ]
         return ast.Call(
             func=ast.Attribute(
-                value=self._get("frame"), attr="interact", ctx=ast.Load()
+                value=self._get("frame"), attr="interact", ctx=_LOAD
             ),
             args=args,
             keywords=[],
@@ -298,7 +566,7 @@ class PteraTransformer(NodeTransformer):
             for a in args
         ]
         return ast.Call(
-            func=ast.Name(id=sym, ctx=ast.Load()),
+            func=ast.Name(id=sym, ctx=_LOAD),
             args=list(args),
             keywords=[],
         )
@@ -315,31 +583,32 @@ class PteraTransformer(NodeTransformer):
         error = [x for x in error if self.should_instrument(x)]
         exit = [x for x in exit if self.should_instrument(x, exit_tag)]
 
-        enter_stmts = [
-            self.standalone_interaction(sym, None, enter_tag, True, False)
-            for sym in enter
-        ]
-        body = reduce(list.__add__, [*enter_stmts, body])
+        enter_stmts = []
+        for sym in enter:
+            enter_stmts.extend(
+                self.standalone_interaction(sym, None, enter_tag, True, False)
+            )
+        body = enter_stmts + body
 
         if not error and not exit:
             return body
 
-        exit_stmts = [
-            self.standalone_interaction(sym, None, exit_tag, True, False)
-            for sym in exit
-        ]
-        finalbody = reduce(list.__add__, exit_stmts, [])
+        finalbody = []
+        for sym in exit:
+            finalbody.extend(
+                self.standalone_interaction(sym, None, exit_tag, True, False)
+            )
 
         handlers = [
             ast.ExceptHandler(
-                type=ast.Name(id="BaseException", ctx=ast.Load()),
+                type=ast.Name(id="BaseException", ctx=_LOAD),
                 name="#error",
                 body=[
                     *self.standalone_interaction(
                         sym,
                         None,
                         None,
-                        ast.Name(id="#error", ctx=ast.Load()),
+                        ast.Name(id="#error", ctx=_LOAD),
                         False,
                     ),
                     ast.Raise(),
@@ -376,11 +645,10 @@ class PteraTransformer(NodeTransformer):
         elif isinstance(target, ast.Subscript) and isinstance(
             target.value, ast.Name
         ):
-            slc = target.slice
-            slc = slc.value if isinstance(target.slice, ast.Index) else slc
+            slc = _slice_value(target.slice)
             value_args = [
                 target.value.id,
-                self._wrap_call("__ptera_Key", "index", deepcopy(slc)),
+                self._wrap_call("__ptera_Key", "index", slc),
                 ann_arg,
                 value_arg,
                 True,
@@ -413,31 +681,47 @@ class PteraTransformer(NodeTransformer):
             new_value = self._interact(*value_args)
         if isinstance(target, str):
             assert not expression
-            return [ast.Expr(new_value)]
+            return [_locate(ast.Expr(new_value), orig)]
         elif expression:
-            return ast.NamedExpr(
-                target=target,
-                value=new_value,
-                lineno=orig.lineno,
-                col_offset=orig.col_offset,
-            )
+            return _locate(ast.NamedExpr(target=target, value=new_value), orig)
         else:
             return [
-                ast.Assign(
-                    targets=[target],
-                    value=new_value,
-                    lineno=orig.lineno,
-                    col_offset=orig.col_offset,
-                )
+                _locate(ast.Assign(targets=[target], value=new_value), orig)
             ]
 
+    def collect_annotations(self, stmts):
+        """Record the annotations of the variables declared in stmts.
+
+        This records the same annotations as visiting stmts would, but
+        only goes through statements.
+        """
+        todo = stmts[::-1]
+        while todo:
+            node = todo.pop()
+            if isinstance(node, ast.AnnAssign):
+                if isinstance(node.target, ast.Name):
+                    name = node.target.id
+                    self.annotated[name] = self._evaluate(
+                        self._ann(node.annotation)
+                    )
+                    self.linenos[name] = node.target.lineno
+            elif not isinstance(node, ast.FunctionDef):
+                children = []
+                for field in _BLOCK_FIELDS:
+                    children += getattr(node, field, None) or []
+                children.reverse()
+                todo += children
+
     def visit_body(self, stmts):
         new_body = []
+        extend = new_body.extend
+        append = new_body.append
         for stmt in map(self.visit, stmts):
-            if isinstance(stmt, list):
-                new_body.extend(stmt)
+            # Visitors return either a single statement or a list of them
+            if type(stmt) is list:
+                extend(stmt)
             else:
-                new_body.append(stmt)
+                append(stmt)
         return new_body
 
     def generate_interactions(self, target):
@@ -449,24 +733,20 @@ class PteraTransformer(NodeTransformer):
                 target.vararg,
                 target.kwarg,
             ]
-            return reduce(
-                list.__add__,
-                [
-                    self.generate_interactions(arg)
-                    for arg in arglist
-                    if arg is not None
-                ],
-                [],
-            )
+            stmts = []
+            for arg in arglist:
+                if arg is not None:
+                    stmts.extend(self.generate_interactions(arg))
+            return stmts
 
         elif isinstance(target, ast.arg):
             return self.make_interaction(
                 target=ast.copy_location(
-                    ast.Name(id=target.arg, ctx=ast.Store()), target
+                    ast.Name(id=target.arg, ctx=_STORE), target
                 ),
                 ann=self._ann(target.annotation),
                 value=ast.copy_location(
-                    ast.Name(id=target.arg, ctx=ast.Load()), target
+                    ast.Name(id=target.arg, ctx=_LOAD), target
                 ),
                 orig=target,
             )
@@ -474,11 +754,11 @@ class PteraTransformer(NodeTransformer):
         elif isinstance(target, ast.Name):
             return self.make_interaction(
                 target=ast.copy_location(
-                    ast.Name(id=target.id, ctx=ast.Store()), target
+                    ast.Name(id=target.id, ctx=_STORE), target
                 ),
                 ann=None,
                 value=ast.copy_location(
-                    ast.Name(id=target.id, ctx=ast.Load()), target
+                    ast.Name(id=target.id, ctx=_LOAD), target
                 ),
                 orig=target,
             )
@@ -492,21 +772,39 @@ class PteraTransformer(NodeTransformer):
         else:  # pragma: no cover
             raise NotImplementedError(target)
 
-    def visit_FunctionDef(self, node, root=False):
-        if not root:
-            return node
+    def visit_FunctionDef(self, node):
+        # Nested functions are not instrumented
+        return node
+
+    def instruments_body(self):
+        """Return whether an interaction may be generated in the body.
+
+        The body only interacts with the variables it assigns, or assigns
+        an attribute or index of, and with hashvars such as ``#value`` or
+        ``#loop_x``.
+        """
+        names = self.mutated | self.stored
+        for el in self.to_instrument:
+            name = el.name
+            if name is None or name in names:
+                return True
+            elif name.startswith("#") and name not in _ROOT_HASHVARS:
+                return True
+        return False
 
+    def visit_root(self, node):
+        """Instrument the FunctionDef of the function being transformed."""
         new_body = []
 
         for external in sorted(self.external):
             new_body.extend(
                 self.make_interaction(
-                    target=ast.Name(id=external, ctx=ast.Store()),
+                    target=ast.Name(id=external, ctx=_STORE),
                     ann=None,
                     value=ast.Subscript(
-                        value=ast.Name(id="__ptera_globals", ctx=ast.Load()),
-                        slice=ast.Index(value=ast.Constant(external)),
-                        ctx=ast.Load(),
+                        value=ast.Name(id="__ptera_globals", ctx=_LOAD),
+                        slice=_index(ast.Constant(external)),
+                        ctx=_LOAD,
                     ),
                     orig=node,
                 )
@@ -517,7 +815,7 @@ class PteraTransformer(NodeTransformer):
                 self.make_interaction(
                     target=fv,
                     ann=None,
-                    value=ast.Name(id=fv, ctx=ast.Load()),
+                    value=ast.Name(id=fv, ctx=_LOAD),
                     orig=node,
                 )
             )
@@ -539,7 +837,13 @@ class PteraTransformer(NodeTransformer):
                 wrapped_body.append(first)
                 body = body[1:]
 
-        new_body += self.visit_body(node.body)
+        if self.instruments_body():
+            new_body += self.visit_body(node.body)
+        else:
+            # Nothing in the body can be instrumented, so it can be left as
+            # it is, but the info should still list the annotations
+            self.collect_annotations(node.body)
+            new_body += node.body
         new_body = self.delimit(
             new_body,
             ["#enter"],
@@ -565,7 +869,7 @@ class PteraTransformer(NodeTransformer):
             )
         )
 
-        return ast.copy_location(
+        return _locate(
             ast.FunctionDef(
                 name=node.name,
                 args=node.args,
@@ -590,7 +894,7 @@ class PteraTransformer(NodeTransformer):
             [f"#endloop_{v}" for v in svc.vars],
         )
 
-        return ast.copy_location(
+        return _locate(
             ast.For(
                 target=node.target,
                 iter=self.visit(node.iter),
@@ -604,12 +908,10 @@ class PteraTransformer(NodeTransformer):
         if node.name is None:
             new_body = []
         else:
-            target = ast.copy_location(
-                ast.Name(id=node.name, ctx=ast.Store()), node
-            )
+            target = ast.copy_location(ast.Name(id=node.name, ctx=_STORE), node)
             new_body = self.generate_interactions(target)
         new_body.extend(self.visit_body(node.body))
-        return ast.copy_location(
+        return _locate(
             ast.ExceptHandler(
                 name=node.name,
                 type=node.type and self.visit(node.type),
@@ -658,47 +960,44 @@ class PteraTransformer(NodeTransformer):
             x = _ptera_interact('x', None, y + z)
         """
 
-        def _decompose(targets, transform):
+        # Multiple targets and tuple targets are decomposed into an
+        # assignment to a temporary variable followed by assignments from
+        # it, which may need to be decomposed further
+        accum = []
+        todo = [(node.targets, node.value)]
+        while todo:
+            targets, value = todo.pop()
+            if len(targets) > 1:
+                elts = targets
+            elif isinstance(targets[0], ast.Tuple):
+                elts = targets[0].elts
+            else:
+                accum += self.make_interaction(
+                    targets[0], None, value, orig=node
+                )
+                continue
+
             var_all = _gensym()
-            ass_all = ast.copy_location(
-                ast.Assign(
-                    targets=[ast.Name(id=var_all, ctx=ast.Store())],
-                    value=node.value,
-                ),
-                node,
-            )
-            accum = [ass_all]
-            for i, tgt in enumerate(targets):
-                accum += self.visit_Assign(
-                    ast.copy_location(
-                        ast.Assign(
-                            targets=[tgt],
-                            value=transform(
-                                ast.Name(id=var_all, ctx=ast.Load()), i
-                            ),
-                        ),
-                        node,
-                    )
+            accum.append(
+                _locate(
+                    ast.Assign(
+                        targets=[ast.Name(id=var_all, ctx=_STORE)],
+                        value=value,
+                    ),
+                    node,
                 )
-            return accum
-
-        targets = node.targets
-        if len(targets) > 1:
-            return _decompose(targets, lambda value, i: value)
-
-        elif isinstance(targets[0], ast.Tuple):
-            return _decompose(
-                targets[0].elts,
-                lambda value, i: ast.Subscript(
-                    value=value,
-                    slice=ast.Index(value=ast.Constant(i)),
-                    ctx=ast.Load(),
-                ),
-            )
-        else:
-            return self.make_interaction(
-                targets[0], None, node.value, orig=node
             )
+            parts = []
+            for i, tgt in enumerate(elts):
+                part = ast.Name(id=var_all, ctx=_LOAD)
+                if elts is not targets:
+                    part = ast.Subscript(
+                        value=part, slice=_index(ast.Constant(i)), ctx=_LOAD
+                    )
+                parts.append(([tgt], part))
+            parts.reverse()
+            todo += parts
+        return accum
 
     def visit_AugAssign(self, node):
         if isinstance(node.target, ast.Name) and self.should_instrument(
@@ -709,7 +1008,7 @@ class PteraTransformer(NodeTransformer):
                 *self.make_interaction(
                     node.target,
                     None,
-                    ast.Name(id=node.target.id, ctx=ast.Load()),
+                    ast.Name(id=node.target.id, ctx=_LOAD),
                     orig=node,
                 ),
             ]
@@ -743,7 +1042,7 @@ class PteraTransformer(NodeTransformer):
             name = alias.asname or alias.name
             if "." not in name:
                 name_node = ast.copy_location(
-                    ast.Name(id=name, context=ast.Load()),
+                    ast.Name(id=name, ctx=_LOAD),
                     node,
                 )
                 stmts.extend(self.generate_interactions(name_node))
@@ -757,7 +1056,7 @@ class PteraTransformer(NodeTransformer):
             self.visit(node.value or ast.Constant(value=None)),
             True,
         )
-        return ast.copy_location(ast.Return(value=new_value), node)
+        return _locate(ast.Return(value=new_value), node)
 
     def visit_Yield(self, node):
         new_value = self._interact(
@@ -774,7 +1073,7 @@ class PteraTransformer(NodeTransformer):
             ast.Yield(value=new_value),
             True,
         )
-        return ast.copy_location(new_yield, node)
+        return _locate(new_yield, node)
 
 
 class _Conformer:
@@ -835,13 +1134,26 @@ class _Conformer2:
         self.listener(new)
 
 
+def _find_code(code, name):
+    """Find the code object for the function named name inside code."""
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType) and const.co_name == name:
+            return const
+    raise AssertionError(f"No code for '{name}'")  # pragma: no cover
+
+
 def _compile(filename, tree, freevars):
+    """Compile the FunctionDef tree and return the function's code object."""
+    name = tree.name
     if freevars:
+        # We wrap the function in a function called #WRAP that takes the
+        # closure variables as arguments, so that they are compiled as
+        # free variables instead of globals.
         if sys.version_info >= (3, 8, 0):  # pragma: no cover
             kwargs = {"posonlyargs": []}
         else:  # pragma: no cover
             kwargs = {}
-        tree = ast.copy_location(
+        tree = _locate(
             ast.FunctionDef(
                 name="#WRAP",
                 args=ast.arguments(
@@ -853,48 +1165,95 @@ def _compile(filename, tree, freevars):
                     defaults=[],
                     **kwargs,
                 ),
-                body=[tree, ast.Return(ast.Name(id=tree.name, ctx=ast.Load()))],
+                body=[tree, ast.Return(ast.Name(id=tree.name, ctx=_LOAD))],
                 decorator_list=[],
                 returns=tree.returns,
             ),
             tree,
         )
-        ast.fix_missing_locations(tree)
-
-    return compile(ast.Module(body=[tree], type_ignores=[]), filename, "exec")
-
-
-def _standard_info():
-    return {
-        "#enter": {
-            "name": "#enter",
-            "annotation": enter_tag,
-            "provenance": "meta",
-            "doc": None,
-            "location": None,
-        },
-        "#exit": {
-            "name": "#exit",
-            "annotation": exit_tag,
-            "provenance": "meta",
-            "doc": None,
-            "location": None,
-        },
-        "#receive": {
-            "name": "#receive",
-            "annotation": enter_tag,
-            "provenance": "meta",
-            "doc": None,
-            "location": None,
-        },
-        "#yield": {
-            "name": "#yield",
-            "annotation": exit_tag,
-            "provenance": "meta",
-            "doc": None,
-            "location": None,
-        },
+
+    code = compile(ast.Module(body=[tree], type_ignores=[]), filename, "exec")
+    if freevars:
+        code = _find_code(code, "#WRAP")
+    return _find_code(code, name)
+
+
+# Info about the variables that every instrumented function has
+_STANDARD_INFO = {
+    "#enter": {
+        "name": "#enter",
+        "annotation": enter_tag,
+        "provenance": "meta",
+        "doc": None,
+        "location": None,
+    },
+    "#exit": {
+        "name": "#exit",
+        "annotation": exit_tag,
+        "provenance": "meta",
+        "doc": None,
+        "location": None,
+    },
+    "#receive": {
+        "name": "#receive",
+        "annotation": enter_tag,
+        "provenance": "meta",
+        "doc": None,
+        "location": None,
+    },
+    "#yield": {
+        "name": "#yield",
+        "annotation": exit_tag,
+        "provenance": "meta",
+        "doc": None,
+        "location": None,
+    },
+}
+
+
+def _transform_code(src, filename, lineno, freevars, lib, glb, to_instrument):
+    """Instrument the function in src and compile it.
+
+    Returns the new code object, a dictionary mapping each variable to
+    its ``(annotation, provenance, doc, lineno)`` and the list of
+    ``(node, value)`` pairs for the annotations that were evaluated in glb.
+    """
+    tree = ast.parse(src, filename)
+    tree = tree.body[0]
+    assert isinstance(tree, ast.FunctionDef)
+    tree.decorator_list = []
+    # Shift the fresh tree to the function's actual line numbers now, before
+    # the transform starts to reuse some of its nodes in several places
+    ast.increment_lineno(tree, lineno - 1)
+
+    # Scrape the comments in the function's source and map them to lines.
+    comments = _scrape_comments(src, tree, lineno)
+
+    transformer = PteraTransformer(
+        tree=tree,
+        evc=ExternalVariableCollector(tree, comments, freevars),
+        lib=lib,
+        filename=filename,
+        glb=glb,
+        to_instrument=to_instrument,
+    )
+    new_code = _compile(filename, transformer.result, freevars)
+
+    variables = {
+        k: (
+            transformer.annotated.get(k, ABSENT),
+            transformer.provenance.get(k),
+            transformer.vardoc.get(k),
+            transformer.linenos.get(k),
+        )
+        for k in transformer.used | transformer.assigned
     }
+    evaluated = [
+        (node, value)
+        for node, value in transformer.evalcache.items()
+        if node is not None
+    ]
+    return new_code, variables, evaluated
 
 
 def transform(fn, proceed, to_instrument=True, set_conformer=True):
@@ -956,27 +1315,8 @@ def transform(fn, proceed, to_instrument=True, set_conformer=True):
     if to_instrument is True:
         to_instrument = [_GENERIC]
 
-    src = dedent(inspect.getsource(fn))
-
-    # Scrape the comments in the function's source and map them to lines.
-    comments = {}
-    for tok in tokenize.tokenize(_readline_mock(src)):
-        if tok.type == tokenize.COMMENT:
-            if tok.line.strip().startswith("#"):
-                line = tok.end[0]
-                comments[line + 1] = tok.string[1:].strip()
-                if line in comments:
-                    comments[line + 1] = (
-                        comments[line] + "\n" + comments[line + 1]
-                    )
-                    del comments[line]
-
-    # Perform the transform
-    filename = inspect.getsourcefile(fn)
-    tree = ast.parse(src, filename)
-    tree = tree.body[0]
-    assert isinstance(tree, ast.FunctionDef)
-    tree.decorator_list = []
+    src, filename, lineno = _get_source(fn.__code__)
+    freevars = fn.__code__.co_freevars
 
     fnsym = _gensym()
     glb = fn.__globals__
@@ -998,24 +1338,40 @@ def transform(fn, proceed, to_instrument=True, set_conformer=True):
         {name: value for name, value in lib.values() if value is not None}
     )
 
-    transformer = PteraTransformer(
-        tree=tree,
-        evc=ExternalVariableCollector(tree, comments, fn.__code__.co_freevars),
-        lib=lib,
-        filename=filename,
-        glb=glb,
-        to_instrument=to_instrument,
+    cachekey = (
+        src,
+        filename,
+        lineno,
+        freevars,
+        id(proceed),
+        id(glb),
+        frozenset(to_instrument),
     )
-    new_tree = transformer.result
-    ast.fix_missing_locations(new_tree)
-    _, lineno = inspect.getsourcelines(fn)
-    ast.increment_lineno(new_tree, lineno - 1)
-    freevars = fn.__code__.co_freevars
-    new_fn = _compile(filename, new_tree, freevars)
-
-    fname = fn.__name__
-    save = glb.get(fname, None)
-    exec(new_fn, glb, glb)
+    with _transform_cache_lock:
+        entry = _transform_cache.get(cachekey)
+        if entry is not None:
+            _transform_cache.move_to_end(cachekey)
+
+    # The code depends on the values the annotations had in glb, which may
+    # have changed since, e.g. if the module was reloaded
+    if entry is not None and _same_evaluations(entry[3], glb, filename):
+        # The cached code refers to the function through the symbol that
+        # was generated when it was compiled, so we rename it to fnsym
+        new_code, oldsym, variables, _ = entry
+        new_code = _with_names(
+            new_code,
+            tuple(
+                fnsym if name == oldsym else name for name in new_code.co_names
+            ),
+        )
+    else:
+        new_code, variables, evaluated = _transform_code(
+            src, filename, lineno, freevars, lib, glb, to_instrument
+        )
+        with _transform_cache_lock:
+            _transform_cache[cachekey] = (new_code, fnsym, variables, evaluated)
+            if len(_transform_cache) > _transform_cache_size:
+                _transform_cache.popitem(last=False)
 
     try:
         from codefind import code_registry
@@ -1025,41 +1381,32 @@ def transform(fn, proceed, to_instrument=True, set_conformer=True):
     except ImportError:  # pragma: no cover
         pass
 
-    # Get the new function (populated with exec)
-    if "#WRAP" in glb:
-        # If the function is a closure, we have created a function
-        # called #WRAP that takes the closure variables as arguments
-        # and returns the function that interests us.
-        actual_fn = glb.pop("#WRAP")(
-            *[cell.cell_contents for cell in fn.__closure__]
-        )
+    # Build the new function directly from its code object, sharing the
+    # original function's defaults and closure cells
+    if freevars:
+        cells = dict(zip(freevars, fn.__closure__))
+        closure = tuple(cells[name] for name in new_code.co_freevars)
     else:
-        actual_fn = glb[fname]
+        closure = None
+    actual_fn = types.FunctionType(
+        new_code, glb, fn.__name__, fn.__defaults__, closure
+    )
+    actual_fn.__kwdefaults__ = fn.__kwdefaults__
+    actual_fn.__annotations__ = dict(fn.__annotations__)
 
     glb[fnsym] = actual_fn
 
-    # However, we don't want to change the existing mapping of fn
-    glb[fname] = save
-
-    all_vars = transformer.used | transformer.assigned
-
     info = {
         k: {
             "name": k,
-            "annotation": transformer.annotated.get(k, ABSENT),
-            "provenance": transformer.provenance.get(k),
-            "doc": transformer.vardoc.get(k),
-            "location": (
-                filename,
-                fn,
-                transformer.linenos[k] + lineno - 1
-                if k in transformer.linenos
-                else None,
-            ),
+            "annotation": annotation,
+            "provenance": provenance,
+            "doc": doc,
+            "location": (filename, fn, varline),
         }
-        for k in all_vars
+        for k, (annotation, provenance, doc, varline) in variables.items()
     }
-    info.update(_standard_info())
+    info.update({k: dict(v) for k, v in _STANDARD_INFO.items()})
 
     if set_conformer:
         actual_fn._conformer = _Conformer(fn, actual_fn, proceed)
@@ -1083,6 +1430,8 @@ class TransformSet:
             argdefs=fn.__defaults__,
             closure=fn.__closure__,
         )
+        self.base_function.__kwdefaults__ = fn.__kwdefaults__
+        self.base_function.__annotations__ = dict(fn.__annotations__)
         self.base_function.__ptera_discard__ = True
         self._register(None, fn)
 
@@ -89,8 +89,9 @@ class DictPile:
 
     def __getitem__(self, item):
         for d in self.dicts:
-            if item in d:
-                return d[item]
+            value = d.get(item, _MISSING)
+            if value is not _MISSING:
+                return value
         if self.default is _MISSING:  # pragma: no cover
             raise KeyError(item)
         else:
@@ -1,8 +1,11 @@
+import functools
 import sys
+import types
 
 import pytest
 
 from ptera import selector as sel, tag
+from ptera.utils import ABSENT
 
 from .common import one_test_per_assert
 
@@ -186,6 +189,22 @@ def test_select_errors():
         sel.select("pie:tag.Fruit", skip_modules=["tests"])
 
 
+def test_interned_bad_arguments():
+    with pytest.raises(TypeError):
+        # Unexpected argument
+        sel.Element(name="x", bogus=1)
+
+    with pytest.raises(TypeError):
+        # Missing argument
+        sel.Element()
+
+    with pytest.raises(TypeError):
+        # Wrong argument with the right number of arguments
+        sel.Element(bogus=1)
+
+    assert sel.Element(name="x") is sel.Element(name="x")
+
+
 @one_test_per_assert
 def test_validity():
     assert not sel.parse("a($b)").valid
@@ -306,6 +325,20 @@ def test_encode():
     assert str(sel.parse("a > b")) == 'sel("a(!b)")'
 
 
+def _greet(greeting, who, x):
+    return f"{greeting} {who}, {x}"
+
+
+def test_resolve_method_not_function():
+    # The bound callable is not a plain function, so the name of the
+    # argument that receives the instance comes from its signature
+    target = object()
+    method = types.MethodType(functools.partial(_greet, "Hi"), target)
+    selector = sel.select("method > x", env={"method": method})
+    captures = {cap.name: cap.value for cap in selector.captures}
+    assert captures == {"x": ABSENT, "who": target}
+
+
 def test_local_resolve():
     x = 3
 
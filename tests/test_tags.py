@@ -19,6 +19,8 @@ def test_category_set():
     }
     assert (tag.Foo & int).members == {tag.Foo, int}
     assert (int & tag.Foo).members == {tag.Foo, int}
+    assert hash(tag.Foo & tag.Baz) == hash(tag.Baz & tag.Foo)
+    assert len({tag.Foo & tag.Baz, tag.Baz & tag.Foo}) == 1
 
 
 @one_test_per_assert
@@ -38,6 +40,7 @@ def test_match_tag():
     assert mt(tag.Fruit, tag.Fruit & tag.Legume)
     assert not mt(tag.Fruit, tag.Legume)
     assert mt(tag.Fruit, tag.Fruit & int)
+    assert not mt(tag.Fruit & tag.Legume, tag.Fruit & tag.Legume)
 
 
 @one_test_per_assert
@@ -1,5 +1,9 @@
 import functools
+import importlib
+import importlib.util
 import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from contextvars import ContextVar
 from types import SimpleNamespace
@@ -7,7 +11,7 @@ from types import SimpleNamespace
 import pytest
 
 from ptera.selector import Element, SelectorError, select
-from ptera.tags import enter_tag, exit_tag
+from ptera.tags import enter_tag, exit_tag, tag
 from ptera.transform import (
     Key,
     StackedTransforms,
@@ -214,6 +218,40 @@ def test_interact_only_some():
     ]
 
 
+def test_interact_none():
+    def nothing(x: int):
+        y: float = x + 1
+        for i in range(3):
+            z: str = y + i
+        return z
+
+    f = wrap(all=True, names=[])(nothing)
+    data = f(10)
+    assert data.actual_ret == 13
+    assert data == []
+    assert f.info["x"]["annotation"] is int
+    assert f.info["y"]["annotation"] is float
+    assert f.info["z"]["annotation"] is str
+
+    # Only the argument is instrumented, so the body is left as it is
+    f = wrap(all=True, names=["x", "w"])(nothing)
+    data = f(10)
+    assert data.actual_ret == 13
+    assert data == [("x", None, int, 10, True)]
+    assert f.info["z"]["annotation"] is str
+
+
+def test_interact_mutated_argument():
+    def setter(obj):
+        obj.value = 1
+        return obj
+
+    f = wrap(all=True, names=["obj"])(setter)
+    data = f(SimpleNamespace())
+    assert data.actual_ret.value == 1
+    assert [_format_sym(entry) for entry in data] == ["obj", "obj.value"]
+
+
 @one_test_per_assert
 def test_misc():
     assert iceberg(2, 3, z=5).ret == 10
@@ -239,6 +277,16 @@ def test_name_error():
         wishful_thinking()
 
 
+def test_name_error_location():
+    with pytest.raises(NameError) as exc:
+        iceberg(2, 3)
+    tb = exc.value.__traceback__
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+    assert tb.tb_frame.f_code.co_name == "iceberg"
+    assert tb.tb_lineno == _iceberg_line + 9
+
+
 def test_missing_argument():
     with pytest.raises(TypeError):
         chocolat()
@@ -288,6 +336,47 @@ def test_info_external():
     }
 
 
+def test_info_standard_entries_not_shared():
+    def sorbet(x):
+        return x
+
+    f1 = transform(sorbet, proceed=SimpleInteractor)
+    f2 = transform(sorbet, proceed=SimpleInteractor)
+    f1.__ptera_info__["#enter"]["doc"] = "Changed"
+    assert f2.__ptera_info__["#enter"]["doc"] is None
+
+
+def test_info_dotted_annotation():
+    @wrap
+    def pomme(x: functools.partial):
+        y: sys.missing = x
+        z: missing.name = y  # noqa: F821
+        return z
+
+    assert pomme.info["x"]["annotation"] is functools.partial
+    assert pomme.info["y"]["annotation"] is ABSENT
+    assert pomme.info["z"]["annotation"] is ABSENT
+
+
+def test_info_comment_in_string():
+    @wrap
+    def lemon():
+        """Not a
+        # comment"""
+        x = 1
+        # A comment
+        y = x + 1
+        z = f"""{y}
+        # still not a comment"""
+        w = z.split()[0]
+        return int(w)
+
+    assert lemon() == 2
+    assert lemon.info["x"]["doc"] is None
+    assert lemon.info["y"]["doc"] == "A comment"
+    assert lemon.info["w"]["doc"] is None
+
+
 def test_docstring_preserved():
     @wrap
     def docteur(n):
@@ -298,6 +387,114 @@ def test_docstring_preserved():
     assert docteur.__doc__ == """Docstrings should be preserved."""
 
 
+def test_transform_cache():
+    def gateau(x):
+        y = x + 1
+        return y
+
+    f1 = transform(gateau, proceed=SimpleInteractor)
+    f2 = transform(gateau, proceed=SimpleInteractor)
+    assert f1 is not f2
+    assert f1.__code__.co_code == f2.__code__.co_code
+    assert f1.__ptera_token__ != f2.__ptera_token__
+    assert f2.__ptera_token__ in f2.__code__.co_names
+    assert f1.__globals__[f1.__ptera_token__] is f1
+    assert f2.__globals__[f2.__ptera_token__] is f2
+    assert f1.__ptera_info__["y"] == f2.__ptera_info__["y"]
+    assert wrap(gateau)(2) == 3
+
+
+def test_transform_same_code_different_files(tmp_path):
+    fns = []
+    for name in ("a", "b"):
+        path = tmp_path / f"{name}.py"
+        path.write_text("def f(x):\n    y = x + 1\n    return y\n")
+        spec = importlib.util.spec_from_file_location(f"_cotest_{name}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        fns.append(module.f)
+
+    fa, fb = fns
+    assert fa.__code__ == fb.__code__
+    new_fa = transform(fa, proceed=SimpleInteractor)
+    new_fb = transform(fb, proceed=SimpleInteractor)
+    assert new_fa.__code__.co_filename == fa.__code__.co_filename
+    assert new_fb.__code__.co_filename == fb.__code__.co_filename
+    assert new_fb.__ptera_info__["y"]["location"][0].endswith("b.py")
+
+
+def test_transform_cache_reload(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    monkeypatch.delitem(sys.modules, "_reloadtest", raising=False)
+    path = tmp_path / "_reloadtest.py"
+    template = (
+        "from ptera import tag\n"
+        "T = tag.{}\n"
+        "class C:\n"
+        "    pass\n"
+        "def f(x):\n"
+        "    y: T = x\n"
+        "    z: C = y\n"
+        "    return z\n"
+    )
+    to_instrument = [Element(name=None, category=tag.B)]
+
+    path.write_text(template.format("A"))
+    module = importlib.import_module("_reloadtest")
+    new_f = transform(module.f, SimpleInteractor, to_instrument)
+    assert new_f.__ptera_info__["y"]["annotation"] is tag.A
+
+    path.write_text(template.format("B"))
+    module = importlib.reload(module)
+    new_f = transform(module.f, SimpleInteractor, to_instrument)
+    assert new_f.__ptera_info__["y"]["annotation"] is tag.B
+    assert new_f.__ptera_info__["z"]["annotation"] is module.C
+
+    results = Interactions()
+    reset = _current_layer.set((results, {}))
+    try:
+        assert new_f(3) == 3
+    finally:
+        _current_layer.reset(reset)
+    assert results.syms() == ["y"]
+
+
+def test_transform_cache_size(monkeypatch):
+    tmodule = sys.modules["ptera.transform"]
+    monkeypatch.setattr(tmodule, "_transform_cache", OrderedDict())
+    monkeypatch.setattr(tmodule, "_transform_cache_size", 2)
+
+    def tarte(x):
+        return x
+
+    for f in (tarte, puerh.__wrapped__, tarte, chocolat.__wrapped__):
+        transform(f, proceed=SimpleInteractor)
+
+    sources = [key[0] for key in tmodule._transform_cache]
+    assert len(sources) == 2
+    assert "def tarte" in sources[0]
+    assert "def chocolat" in sources[1]
+
+
+def test_transform_cache_threads(monkeypatch):
+    tmodule = sys.modules["ptera.transform"]
+    monkeypatch.setattr(tmodule, "_transform_cache", OrderedDict())
+    monkeypatch.setattr(tmodule, "_transform_cache_size", 1)
+
+    fns = [puerh.__wrapped__, chocolat.__wrapped__]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(
+            pool.map(
+                lambda i: transform(fns[i % 2], proceed=SimpleInteractor),
+                range(200),
+            )
+        )
+
+    assert len(results) == 200
+    assert len(tmodule._transform_cache) == 1
+
+
 def _has_problem(selector, problem):
     with pytest.raises(SelectorError) as exc:
         select(selector, strict=True)
@@ -532,6 +729,18 @@ def test_closure():
     ]
 
 
+def test_closure_shared_cells():
+    x = 3
+
+    @wrap(all=True)
+    def inside_scoop(y=7):
+        return x + y
+
+    x = 30
+    data = inside_scoop()
+    assert data.ret == 37
+
+
 class Animal:
     def __init__(self, cry):
         self._cry = cry
@@ -598,6 +807,22 @@ def test_kwonly():
     ]
 
 
+def test_kwonly_default_transform_set():
+    def waycooler(x, *, y=2):
+        return x + y
+
+    fn, *_ = TransformSet(waycooler, proceed=SimpleInteractor).transform_for(
+        [Element(name="x")]
+    )
+    results = Interactions()
+    reset = _current_layer.set((results, {}))
+    try:
+        assert fn(1) == 3
+    finally:
+        _current_layer.reset(reset)
+    assert results.syms() == ["x"]
+
+
 def test_error_in_execution():
     verr = ValueError(999)
 
@@ -709,10 +934,56 @@ def test_augassign():
 
 
 def test_augassign_ignore():
-    # Covers the else clause in the augassign transform
-    f3 = wrap(all=True, names=["y"])(f)
+    # Covers the else clause in the augassign transform. #value is
+    # instrumented so that the body is walked, but x is not
+    f3 = wrap(all=True, names=["y", "#value"])(f)
     data = f3(2, 10)
-    assert data == [("y", None, None, 10, True)]
+    assert data.actual_ret == 15
+    assert data == [
+        ("y", None, None, 10, True),
+        ("#value", None, None, 15, True),
+    ]
+
+
+def test_instrument_shadowed_by_lambda():
+    def peche(x):
+        q = x + 1
+        key = lambda q: -q  # noqa: E731
+        return key(q)
+
+    data = wrap(all=True, names=["q"])(peche)(3)
+    assert data.actual_ret == -4
+    assert data == [("q", None, None, 4, True)]
+
+
+def test_instrument_in_except():
+    def poire(x):
+        try:
+            return x / 0
+        except ZeroDivisionError:
+            m = 1
+            return m
+
+    data = wrap(all=True, names=["m"])(poire)(3)
+    assert data.actual_ret == 1
+    assert data == [("m", None, None, 1, True)]
+
+    def coing(x):
+        try:
+            return x / 0
+        except ZeroDivisionError:
+            import math
+
+            box = SimpleNamespace()
+            try:
+                box.m = math.floor(x / 2)
+            except TypeError as err:  # pragma: no cover
+                box.m = err
+            return box.m
+
+    data = wrap(all=True, names=["box"])(coing)(3)
+    assert data.actual_ret == 1
+    assert [_format_sym(entry) for entry in data] == ["box", "box.m"]
 
 
 def test_stacked_transforms():